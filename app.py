@@ -1,13 +1,23 @@
 import streamlit as st
 import gspread
+from gspread.utils import absolute_range_name
 import pandas as pd
-import plotly.express as px
+import numpy as np
 import plotly.graph_objects as go
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
+import gc
+import hashlib
+import inspect
 import os
+import re
 import pickle
+import stat
+import tempfile
+import time
 from datetime import datetime
+from collections import Counter
+from functools import wraps
 
 st.set_page_config(
     page_title="MORAES Dashboard",
@@ -51,8 +61,18 @@ CH_AMAZON   = '#B5651D'   # ámbar quemado → canal Amazon
 CH_DIRECTO  = '#D9A441'   # oro → canal Directo
 # secuencia categórica graduada (marrón profundo → oro claro)
 CHART_SEQ   = ['#3E1F12', '#6B371B', '#944925', '#B5651D', '#C8893A', '#D9A441', '#E8C170']
+# layout base de todos los gráficos; cada figura solo agrega sus diferencias
+# (va por update_layout y no como template de plotly.io: el tema de Streamlit pisa el template)
+PLOTLY_LAYOUT = dict(
+    paper_bgcolor='rgba(0,0,0,0)',
+    plot_bgcolor='rgba(0,0,0,0)',
+    font=dict(family='Inter', color=TEXT_MUTED, size=11),
+    margin=dict(t=10, b=10, l=10, r=10),
+)
 
 # ── Autenticación ─────────────────────────────────────────────────
+# Un solo cliente por proceso: las credenciales se refrescan solas en cada request
+@st.cache_resource(show_spinner=False)
 def autenticar():
     # Streamlit Cloud: service account desde secrets
     if 'gcp_service_account' in st.secrets:
@@ -88,141 +108,312 @@ def autenticar():
 
     return gspread.authorize(creds)
 
+# ── Limpieza ──────────────────────────────────────────────────────
+# Patrones compilados una sola vez al importar
+RE_MONEDA     = re.compile(r'[$,]')
+RE_MONEDA_PCT = re.compile(r'[$,%]')
+# filas que no son datos: primera columna vacía o que empieza con TOTAL
+RE_FILA_TOTAL = re.compile(r'^\s*(?:$|(?i:total))')
+RE_VACIO      = re.compile(r'\s*')
+RE_SKU_NOTA   = re.compile(r'^\s*$|^\*')
+RE_NO_GASTO   = re.compile(r'^\s*(?:$|(?i:total))|🔴|Fondo rojo|Categorías')
+RE_PAGADO     = re.compile(r'✅|TRUE|true|si|sí', re.IGNORECASE)
+# Cuenta vacía o marcada como no pagada → venta aún no cobrada
+RE_NO_PAGADO  = re.compile(r'^\s*$|NO HAN PAGADO|NO PAGADO', re.IGNORECASE)
+# valores de '¿En inventario?' que cuentan como sí (con espacios y en cualquier caja)
+RE_SI_INVENTARIO = re.compile(r'\s*(?:sí|si|yes|true)\s*', re.IGNORECASE)
+
+def a_numero(serie, patron=RE_MONEDA):
+    """Convierte una columna de montos ('$1,234.50') a float en una sola pasada vectorizada."""
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie.fillna(0)
+    return pd.to_numeric(serie.astype(str).str.replace(patron, '', regex=True), errors='coerce').fillna(0)
+
+def a_numeros(df, cols, patron=RE_MONEDA):
+    """Aplica a_numero a las columnas de `cols` presentes en `df`, con una sola asignación."""
+    cols = [c for c in cols if c in df.columns]
+    if cols:
+        df[cols] = df[cols].apply(a_numero, patron=patron)
+
 # ── Carga de datos ────────────────────────────────────────────────
+# Pestañas que usa el dashboard: nombre → (libro, criterio sobre el título).
+# Se toma la primera pestaña del libro cuyo título cumple el criterio.
+HOJAS = {
+    'gastos':        (SHEET_FINANZAS_ID, lambda t: 'gastos' in t.lower() and 'amazon' not in t.lower()),
+    'ventas':        (SHEET_FINANZAS_ID, lambda t: 'ventas' in t.lower()),
+    'margenes':      (SHEET_FINANZAS_ID, lambda t: 'rgen' in t.lower() or 'argen' in t.lower()),
+    'inventario':    (SHEET_FINANZAS_ID, lambda t: 'inventario' in t.lower()),
+    'ventas_amazon': (SHEET_AMAZON_ID,   lambda t: t.strip() == 'Ventas Amazon'),
+    'gastos_amazon': (SHEET_AMAZON_ID,   lambda t: 'gastos amazon' in t.lower() or ('amazon' in t.lower() and 'gasto' in t.lower())),
+}
+
+@st.cache_resource(show_spinner=False)
+def abrir_libro(key):
+    # el handle se reutiliza entre recargas: open_by_key hace su propio fetch de metadata
+    return autenticar().open_by_key(key)
+
+def leer_hojas(nombres, params=None):
+    """Descarga las pestañas `nombres` de HOJAS con un solo values_batch_get por libro."""
+    hojas = {}
+    for libro in dict.fromkeys(HOJAS[n][0] for n in nombres):
+        sh = abrir_libro(libro)
+        titulos = [ws.title for ws in sh.worksheets()]
+        elegidas = {}
+        for nombre in nombres:
+            key, criterio = HOJAS[nombre]
+            titulo = next((t for t in titulos if criterio(t)), None) if key == libro else None
+            if titulo is not None:
+                elegidas[nombre] = titulo
+        if not elegidas:
+            continue
+        resp = sh.values_batch_get([absolute_range_name(t) for t in elegidas.values()], params=params)
+        for nombre, rango in zip(elegidas, resp.get('valueRanges', [])):
+            hojas[nombre] = rango.get('values', [])
+    return hojas
+
+# TTL según volatilidad: ventas, gastos e inventario cambian a diario;
+# la tabla de márgenes (costos y precios por SKU) casi nunca.
+# La caché va por libro y por TTL: un libro caído no arrastra las pestañas del otro.
+REFERENCIA = ('margenes',)
+
 @st.cache_data(ttl=300)
-def cargar_gastos_operativos():
+def hojas_movimiento(libro):
+    # montos como números (no '$1,234.00'); fechas con el mismo texto que muestra la hoja
+    return leer_hojas(
+        [n for n, (key, _) in HOJAS.items() if key == libro and n not in REFERENCIA],
+        params={'valueRenderOption': 'UNFORMATTED_VALUE', 'dateTimeRenderOption': 'FORMATTED_STRING'},
+    )
+
+@st.cache_data(ttl=3600)
+def hojas_referencia(libro):
+    return leer_hojas([n for n, (key, _) in HOJAS.items() if key == libro and n in REFERENCIA])
+
+# libro → error de lectura en este rerun; se avisa una sola vez, fuera de las cachés
+ERRORES_LIBRO = {}
+
+def hoja(nombre, opcional=False):
+    """Valores de la pestaña `nombre`, tomados de la caché de su libro y su TTL."""
+    libro = HOJAS[nombre][0]
+    # un libro que ya falló en este rerun no se vuelve a pedir por cada loader
+    if libro in ERRORES_LIBRO:
+        valores = None
+    else:
+        try:
+            valores = (hojas_referencia(libro) if nombre in REFERENCIA else hojas_movimiento(libro)).get(nombre)
+        except Exception as e:
+            ERRORES_LIBRO[libro] = e
+            valores = None
+    if valores is None and not opcional:
+        if libro in ERRORES_LIBRO:
+            raise ValueError(f"no se pudo leer el libro de '{nombre}'")
+        raise ValueError(f"no se encontró la pestaña '{nombre}'")
+    return valores
+
+def _encabezados(fila):
+    """Limpia espacios y numera los nombres repetidos (Notas, Notas_1, ...)."""
+    vistos = Counter()
+    usados = set()
+    out = []
+    for c in fila:
+        c = str(c).strip()
+        nombre = c
+        # el sufijo se sigue subiendo si choca con un nombre ya generado (p.ej. 'Notas_1' real)
+        while nombre in usados:
+            vistos[c] += 1
+            nombre = f"{c}_{vistos[c]}"
+        usados.add(nombre)
+        out.append(nombre)
+    return out
+
+def _registros(values, head, expected_headers=None):
+    """Equivalente a ws.get_all_records(head=...) sobre valores ya descargados."""
+    header = _encabezados(values[head - 1] if len(values) >= head else [])
+    if expected_headers:
+        faltan = [h for h in expected_headers if h not in header]
+        if faltan:
+            raise ValueError(f"faltan columnas {faltan}")
+    # pandas rellena las filas cortas; reindex recorta/completa al ancho del encabezado
+    df = pd.DataFrame(values[head:]).reindex(columns=range(len(header))).fillna('')
+    df.columns = header
+    # descartar filas completamente vacías con una sola máscara
+    return df[(df.to_numpy(dtype=object) != '').any(axis=1)]
+
+# Segunda capa de caché en disco: sobrevive a reinicios del proceso (cold start)
+# y evita volver a Sheets mientras el parquet tenga menos de `ttl` segundos.
+# Carpeta propia (0700) dentro de la temporal del sistema: /tmp en Linux/Streamlit Cloud,
+# %TEMP% en Windows. Los parquet tienen datos financieros: no deben quedar legibles por otros.
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'moraes_cache')
+
+def _carpeta_privada():
+    """Crea CACHE_DIR si falta y verifica que sea del usuario actual y solo accesible por él."""
+    os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+    info = os.lstat(CACHE_DIR)
+    # en POSIX se rechaza un symlink o una carpeta creada por otro usuario o con permisos abiertos
+    if os.name == 'posix' and (stat.S_ISLNK(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077):
+        raise PermissionError(f"{CACHE_DIR} no es una carpeta privada")
+
+def en_disco(nombre, ttl):
+    """Decorador: guarda el DataFrame del loader en CACHE_DIR/moraes_<nombre>_<versión>.parquet."""
+    def decorador(fn):
+        # la versión es un hash del código del loader: tras un redeploy que cambia
+        # las columnas, el parquet viejo no se lee (tiene otro nombre)
+        version = hashlib.sha1(inspect.getsource(fn).encode()).hexdigest()[:10]
+        ruta = os.path.join(CACHE_DIR, f'moraes_{nombre}_{version}.parquet')
+        @wraps(fn)
+        def envuelta():
+            # la caché en disco es opcional: si falla se avisa y se cae al loader normal
+            try:
+                _carpeta_privada()
+                if time.time() - os.path.getmtime(ruta) < ttl:
+                    return pd.read_parquet(ruta)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                st.warning(f"Caché en disco '{nombre}' ilegible, se recarga de Sheets: {e}")
+            df = fn()
+            if not df.empty:
+                # con UNFORMATTED_VALUE una columna de texto puede mezclar int y str,
+                # y pyarrow no la serializa: las de texto se pasan a str antes de escribir
+                df = df.astype(dict.fromkeys(df.select_dtypes(include=['object', 'string']).columns, str))
+                tmp = None
+                try:
+                    _carpeta_privada()
+                    # escritura atómica: otra sesión nunca lee un parquet a medio escribir
+                    fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, prefix='moraes_', suffix='.tmp')
+                    os.close(fd)
+                    df.to_parquet(tmp)
+                    os.replace(tmp, ruta)
+                except Exception as e:
+                    if tmp is not None:
+                        try:
+                            os.remove(tmp)
+                        except OSError:
+                            pass
+                    st.warning(f"No se pudo guardar la caché en disco '{nombre}': {e}")
+            return df
+        return envuelta
+    return decorador
+
+def limpiar_disco():
+    """Borra los parquet de en_disco (botón Actualizar)."""
     try:
-        gc = autenticar()
-        sh = gc.open_by_key(SHEET_FINANZAS_ID)
-        ws = next(s for s in sh.worksheets() if 'gastos' in s.title.lower() and 'amazon' not in s.title.lower())
-        df = pd.DataFrame(ws.get_all_records(head=4))
-        df.columns = [c.strip() for c in df.columns]
-        df['Monto Total (USD)'] = pd.to_numeric(
-            df['Monto Total (USD)'].astype(str).str.replace('[$,]', '', regex=True), errors='coerce'
-        ).fillna(0)
-        df = df[df['Fecha'].astype(str).str.strip() != '']
-        # excluir filas de totales / leyenda que no son gastos reales
-        df = df[~df['Fecha'].astype(str).str.strip().str.upper().str.startswith('TOTAL')]
-        df = df[~df['Fecha'].astype(str).str.contains('🔴|Fondo rojo|Categorías', na=False)]
-        df['Pagado'] = df['¿Pagado?'].astype(str).str.contains('✅|TRUE|true|si|sí', case=False)
-        if 'Canal' not in df.columns:
-            df['Canal'] = 'Ambos'
-        df['Canal'] = df['Canal'].astype(str).str.strip()
-        if 'Tipo' not in df.columns:
-            df['Tipo'] = 'Directo'
-        df['Tipo'] = df['Tipo'].astype(str).str.strip()
-        if '¿En inventario?' not in df.columns:
-            df['¿En inventario?'] = 'No'
-        df['En inventario'] = df['¿En inventario?'].astype(str).str.strip().str.lower().isin(['sí','si','yes','true'])
-        return df
-    except Exception as e:
-        st.error(f"Error Gastos Operativos: {e}")
-        return pd.DataFrame()
+        archivos = os.listdir(CACHE_DIR)
+    except OSError:
+        return
+    for f in archivos:
+        if f.startswith('moraes_') and f.endswith(('.parquet', '.tmp')):
+            try:
+                os.remove(os.path.join(CACHE_DIR, f))
+            except OSError:
+                pass
 
 @st.cache_data(ttl=300)
-def cargar_ventas():
-    try:
-        gc = autenticar()
-        frames = []
-        sh1 = gc.open_by_key(SHEET_FINANZAS_ID)
-        ws1 = next((s for s in sh1.worksheets() if 'ventas' in s.title.lower()), None)
-        if ws1:
-            h = ['Fecha','Producto','SKU','Canal','Unidades','Precio Unit (USD)','Total (USD)','Cuenta','Notas']
-            df1 = pd.DataFrame(ws1.get_all_records(head=3, expected_headers=h))
-            df1.columns = [c.strip() for c in df1.columns]
-            df1 = df1[df1['Fecha'].astype(str).str.strip() != '']
-            frames.append(df1)
-        sh2 = gc.open_by_key(SHEET_AMAZON_ID)
-        ws2 = next((s for s in sh2.worksheets() if s.title.strip() == 'Ventas Amazon'), None)
-        if ws2:
-            df2 = pd.DataFrame(ws2.get_all_records(head=3))
-            df2.columns = [c.strip() for c in df2.columns]
-            df2 = df2[df2['Fecha'].astype(str).str.strip() != '']
-            df2 = df2.rename(columns={
-                'Cantidad': 'Unidades',
-                'Precio Unitario (USD)': 'Precio Unit (USD)',
-                'Ingreso Total (USD)': 'Total (USD)',
-                'Fulfillment': 'Cuenta',
-            })
-            if 'Canal' not in df2.columns:
-                df2['Canal'] = 'Amazon'
-            if 'Notas' not in df2.columns:
-                df2['Notas'] = ''
-            frames.append(df2[['Fecha','Producto','SKU','Canal','Unidades','Precio Unit (USD)','Total (USD)','Cuenta','Notas']])
-        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
-        if df.empty:
-            return df
-        # normalizar SKU de Amazon → SKU interno (mismo producto)
-        df['SKU'] = df['SKU'].astype(str).str.strip().replace(SKU_MAP)
-        for col in ['Total (USD)', 'Precio Unit (USD)']:
-            df[col] = pd.to_numeric(df[col].astype(str).str.replace('[$,]', '', regex=True), errors='coerce').fillna(0)
-        df['Unidades'] = pd.to_numeric(df['Unidades'], errors='coerce').fillna(0)
-        cuenta = df['Cuenta'].astype(str).str.strip().str.upper()
-        df['Cobrado'] = ~(cuenta.str.contains('NO HAN PAGADO|NO PAGADO', na=False) | (cuenta == ''))
-        return df
-    except Exception as e:
-        st.error(f"Error Ventas: {e}")
-        return pd.DataFrame()
+@en_disco('gastos', ttl=300)
+def cargar_gastos_operativos():
+    df = _registros(hoja('gastos'), head=4)
+    df['Monto Total (USD)'] = a_numero(df['Monto Total (USD)'])
+    # excluir filas vacías, de totales y de leyenda que no son gastos reales
+    df = df[~df['Fecha'].astype(str).str.contains(RE_NO_GASTO, na=False)]
+    # Fecha como string[pyarrow]; _fecha (minúsculas) es la clave del filtro de mes
+    df['Fecha'] = df['Fecha'].astype('string[pyarrow]')
+    df['_fecha'] = df['Fecha'].str.lower()
+    df['Pagado'] = df['¿Pagado?'].astype(str).str.contains(RE_PAGADO)
+    if 'Canal' not in df.columns:
+        df['Canal'] = 'Ambos'
+    if 'Tipo' not in df.columns:
+        df['Tipo'] = 'Directo'
+    # pocas categorías repetidas: se guardan como category (códigos enteros)
+    for col in ['Canal', 'Tipo']:
+        df[col] = df[col].astype(str).str.strip().astype('category')
+    # el encabezado de categoría varía (Categoria, Categoría, ...): se resuelve una vez aquí
+    cat_col = next((c for c in df.columns if 'categor' in c.lower()), None)
+    if cat_col and 'Categoría' not in df.columns:
+        df = df.rename(columns={cat_col: 'Categoría'})
+    if 'Categoría' in df.columns:
+        df['Categoría'] = df['Categoría'].astype('category')
+    if '¿En inventario?' not in df.columns:
+        df['¿En inventario?'] = 'No'
+    df['En inventario'] = df['¿En inventario?'].astype(str).str.fullmatch(RE_SI_INVENTARIO)
+    # solo las columnas que usa el dashboard: cada filtro posterior mueve menos datos
+    usadas = ['Fecha','_fecha','Descripción','Categoría','Monto Total (USD)','Notas','Canal','Tipo','Pagado','En inventario']
+    return df[[c for c in usadas if c in df.columns]]
 
 @st.cache_data(ttl=300)
-def cargar_margenes():
-    try:
-        gc = autenticar()
-        sh = gc.open_by_key(SHEET_FINANZAS_ID)
-        ws = next(s for s in sh.worksheets() if 'rgen' in s.title.lower() or 'argen' in s.title.lower())
-        h = ['SKU','Canal','Costo COP','Costo USD','Envío','Empaque','Publicidad','Comisión','Costo Total','Precio Venta','Ganancia','Margen %','ROI %']
-        df = pd.DataFrame(ws.get_all_records(head=3, expected_headers=h))
-        df.columns = [c.strip() for c in df.columns]
-        for col in ['Costo Total', 'Precio Venta', 'Ganancia']:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col].astype(str).str.replace('[$,%]', '', regex=True), errors='coerce').fillna(0)
-        df = df[df['SKU'].astype(str).str.strip() != '']
-        df = df[~df['SKU'].astype(str).str.startswith('*')]
+@en_disco('ventas', ttl=300)
+def cargar_ventas():
+    ventas, ventas_amazon = hoja('ventas', opcional=True), hoja('ventas_amazon', opcional=True)
+    frames = []
+    if ventas is not None:
+        h = ['Fecha','Producto','SKU','Canal','Unidades','Precio Unit (USD)','Total (USD)','Cuenta','Notas']
+        df1 = _registros(ventas, head=3, expected_headers=h)
+        # misma proyección que la hoja de Amazon: fuera columnas auxiliares de la hoja
+        frames.append(df1[h])
+    if ventas_amazon is not None:
+        df2 = _registros(ventas_amazon, head=3)
+        df2 = df2.rename(columns={
+            'Cantidad': 'Unidades',
+            'Precio Unitario (USD)': 'Precio Unit (USD)',
+            'Ingreso Total (USD)': 'Total (USD)',
+            'Fulfillment': 'Cuenta',
+        })
+        if 'Canal' not in df2.columns:
+            df2['Canal'] = 'Amazon'
+        if 'Notas' not in df2.columns:
+            df2['Notas'] = ''
+        frames.append(df2[['Fecha','Producto','SKU','Canal','Unidades','Precio Unit (USD)','Total (USD)','Cuenta','Notas']])
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if df.empty:
         return df
-    except Exception as e:
-        st.error(f"Error Márgenes: {e}")
-        return pd.DataFrame()
+    # filas sin fecha: un solo filtro sobre ambas hojas ya unidas
+    df = df[~df['Fecha'].astype(str).str.fullmatch(RE_VACIO)]
+    df['Fecha'] = df['Fecha'].astype('string[pyarrow]')
+    df['_fecha'] = df['Fecha'].str.lower()
+    # normalizar SKU de Amazon → SKU interno (mismo producto)
+    df['SKU'] = df['SKU'].astype(str).str.strip().replace(SKU_MAP).astype('category')
+    a_numeros(df, ['Total (USD)', 'Precio Unit (USD)'])
+    # unidades son conteos: int64 en vez de float64
+    df['Unidades'] = pd.to_numeric(df['Unidades'], errors='coerce').fillna(0).astype(int)
+    df['Canal'] = df['Canal'].astype('category')
+    df['Cobrado'] = ~df['Cuenta'].astype(str).str.contains(RE_NO_PAGADO, na=False)
+    return df
+
+@st.cache_data(ttl=3600)
+@en_disco('margenes', ttl=3600)
+def cargar_margenes():
+    h = ['SKU','Canal','Costo COP','Costo USD','Envío','Empaque','Publicidad','Comisión','Costo Total','Precio Venta','Ganancia','Margen %','ROI %']
+    df = _registros(hoja('margenes'), head=3, expected_headers=h)
+    a_numeros(df, ['Costo Total', 'Precio Venta', 'Ganancia'], RE_MONEDA_PCT)
+    # fuera SKU vacíos y notas al pie ('* ...')
+    df = df[~df['SKU'].astype(str).str.contains(RE_SKU_NOTA)]
+    return df
 
 @st.cache_data(ttl=300)
+@en_disco('gastos_amazon', ttl=300)
 def cargar_gastos_amazon():
-    try:
-        gc = autenticar()
-        sh = gc.open_by_key(SHEET_AMAZON_ID)
-        ws = next(s for s in sh.worksheets() if 'gastos amazon' in s.title.lower() or ('amazon' in s.title.lower() and 'gasto' in s.title.lower()))
-        h = ['Transaction ID','Fecha','Order ID','Tipo de Fee','SKU','Monto (USD)','Descripcion']
-        df = pd.DataFrame(ws.get_all_records(head=2, expected_headers=h))
-        df.columns = [c.strip() for c in df.columns]
-        df['Monto (USD)'] = pd.to_numeric(df['Monto (USD)'].astype(str).str.replace('[$,]', '', regex=True), errors='coerce').fillna(0)
-        return df
-    except Exception as e:
-        st.error(f"Error Gastos Amazon: {e}")
-        return pd.DataFrame()
+    h = ['Transaction ID','Fecha','Order ID','Tipo de Fee','SKU','Monto (USD)','Descripcion']
+    df = _registros(hoja('gastos_amazon'), head=2, expected_headers=h)
+    df['Monto (USD)'] = a_numero(df['Monto (USD)'])
+    return df[['Fecha', 'Monto (USD)']]
 
 @st.cache_data(ttl=300)
+@en_disco('inventario', ttl=300)
 def cargar_inventario():
-    try:
-        gc = autenticar()
-        sh = gc.open_by_key(SHEET_FINANZAS_ID)
-        ws = next(s for s in sh.worksheets() if 'inventario' in s.title.lower())
-        df = pd.DataFrame(ws.get_all_records(head=4))
-        df.columns = [c.strip() for c in df.columns]
-        for col in ['Stock (ajustable)', 'Costo Unit. (USD)', 'Valor en Stock (USD)', 'Precio Mercado (USD)', 'Valor a Mercado (USD)']:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col].astype(str).str.replace('[$,]', '', regex=True), errors='coerce').fillna(0)
-        # solo filas de producto real: SKU no vacío, sin TOTAL ni ⚠️, costo > 0
-        df = df[df['SKU'].astype(str).str.strip() != '']
-        df = df[~df['SKU'].astype(str).str.strip().str.upper().str.startswith('TOTAL')]
-        df = df[df['Costo Unit. (USD)'] > 0]
-        if 'Canal' not in df.columns:
-            df['Canal'] = 'Directo'
-        df['Canal'] = df['Canal'].astype(str).str.strip()
-        return df
-    except Exception as e:
-        st.error(f"Error Inventario: {e}")
-        return pd.DataFrame()
+    df = _registros(hoja('inventario'), head=4)
+    a_numeros(df, ['Stock (ajustable)', 'Costo Unit. (USD)', 'Valor en Stock (USD)', 'Precio Mercado (USD)', 'Valor a Mercado (USD)'])
+    # solo filas de producto real: SKU no vacío, sin TOTAL ni ⚠️, costo > 0
+    df = df[~df['SKU'].astype(str).str.contains(RE_FILA_TOTAL, na=False)]
+    df = df[df['Costo Unit. (USD)'] > 0]
+    if 'Canal' not in df.columns:
+        df['Canal'] = 'Directo'
+    df['Canal'] = df['Canal'].astype(str).str.strip().astype('category')
+    usadas = ['SKU','Producto','Canal','Stock (ajustable)','Costo Unit. (USD)','Valor en Stock (USD)','Precio Mercado (USD)','Valor a Mercado (USD)']
+    return df[[c for c in usadas if c in df.columns]]
 
 # ── Estilos ───────────────────────────────────────────────────────
-st.markdown(f"""
+@st.cache_resource(show_spinner=False)
+def estilos():
+    """CSS del dashboard: la f-string se interpola una sola vez por proceso."""
+    return f"""
 <style>
   @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap');
 
@@ -265,6 +456,10 @@ st.markdown(f"""
     height: 100%;
   }}
   .kpi-card-top {{ border-top: 3px solid; }}
+  .kpi-grid {{ display: grid; gap: 1rem; }}
+  .kpi-grid-5 {{ grid-template-columns: repeat(5, minmax(0, 1fr)); }}
+  .canal-grid {{ grid-template-columns: repeat(3, minmax(0, 1fr)); }}
+  .kpi-grid-3 {{ grid-template-columns: repeat(3, minmax(0, 1fr)); }}
   .kpi-icon {{ font-size: 1.4rem; margin-bottom: 8px; }}
   .kpi-label {{ font-size: 0.7rem; font-weight: 600; letter-spacing: 0.1em; text-transform: uppercase; color: {TEXT_MUTED}; margin-bottom: 4px; }}
   .kpi-value {{ font-size: 1.7rem; font-weight: 700; line-height: 1.1; }}
@@ -347,39 +542,17 @@ st.markdown(f"""
     /* P&L: scroll horizontal (tiene inline flex:0 0 260px que no se puede pisar) */
     .chart-card {{ overflow-x: auto; }}
 
-    /* Streamlit column overrides — usa data-testid internos de Streamlit (no API pública).
-       Si Streamlit cambia su DOM en futuras versiones, revisar estos selectores.
-       !important necesario para pisar los estilos inline que Streamlit inyecta en columnas. */
+    /* Grids de tarjetas (.kpi-grid-*, .canal-grid): menos columnas en pantallas chicas.
+       Son HTML propio, no st.columns, así que no hace falta pisar estilos de Streamlit. */
 
     /* KPIs 5-col → grid 2×2+1 */
-    .mobile-kpi-grid [data-testid="stHorizontalBlock"] {{
-      flex-wrap: wrap !important;
-    }}
-    .mobile-kpi-grid [data-testid="stHorizontalBlock"] > [data-testid="column"] {{
-      flex: 0 0 50% !important;
-      max-width: 50% !important;
-      min-width: 50% !important;
-    }}
+    .kpi-grid-5 {{ grid-template-columns: repeat(2, minmax(0, 1fr)); }}
 
     /* Canales 3-col → 1 columna apilada */
-    .mobile-canal-grid [data-testid="stHorizontalBlock"] {{
-      flex-direction: column !important;
-    }}
-    .mobile-canal-grid [data-testid="stHorizontalBlock"] > [data-testid="column"] {{
-      flex: 0 0 100% !important;
-      max-width: 100% !important;
-      min-width: 100% !important;
-    }}
+    .canal-grid {{ grid-template-columns: minmax(0, 1fr); }}
 
     /* Inventario KPIs 3-col → 2+1 */
-    .mobile-inv-grid [data-testid="stHorizontalBlock"] {{
-      flex-wrap: wrap !important;
-    }}
-    .mobile-inv-grid [data-testid="stHorizontalBlock"] > [data-testid="column"] {{
-      flex: 0 0 50% !important;
-      max-width: 50% !important;
-      min-width: 50% !important;
-    }}
+    .kpi-grid-3 {{ grid-template-columns: repeat(2, minmax(0, 1fr)); }}
 
     /* Gráficos Plotly y donut: ocultos en mobile */
     .mobile-hidden {{ display: none !important; }}
@@ -389,15 +562,27 @@ st.markdown(f"""
     [data-testid="stAppViewContainer"] {{ padding: 0 8px !important; }}
   }}
 </style>
-""", unsafe_allow_html=True)
+"""
+
+st.markdown(estilos(), unsafe_allow_html=True)
 
 # ── Cargar datos ──────────────────────────────────────────────────
+def cargar(loader, etiqueta):
+    """Llama al loader cacheado; los errores se muestran aquí y no quedan en la caché."""
+    try:
+        return loader()
+    except Exception as e:
+        st.error(f"Error {etiqueta}: {e}")
+        return pd.DataFrame()
+
 with st.spinner("Sincronizando con Google Sheets..."):
-    df_gastos   = cargar_gastos_operativos()
-    df_ventas   = cargar_ventas()
-    df_margenes = cargar_margenes()
-    df_amazon   = cargar_gastos_amazon()
-    df_inv      = cargar_inventario()
+    df_gastos   = cargar(cargar_gastos_operativos, 'Gastos Operativos')
+    df_ventas   = cargar(cargar_ventas, 'Ventas')
+    df_margenes = cargar(cargar_margenes, 'Márgenes')
+    df_amazon   = cargar(cargar_gastos_amazon, 'Gastos Amazon')
+    df_inv      = cargar(cargar_inventario, 'Inventario')
+for libro, e in ERRORES_LIBRO.items():
+    st.warning(f"No se pudo leer el libro {libro}: {e}")
 
 # ── Filtro de mes (sidebar colapsado) ────────────────────────────
 with st.sidebar:
@@ -408,13 +593,39 @@ with st.sidebar:
     st.markdown("---")
     if st.button("🔄 Actualizar"):
         st.cache_data.clear()
+        limpiar_disco()
+        # liberar ya los DataFrames que soltó la caché (tienen ciclos internos)
+        gc.collect()
         st.rerun()
     st.markdown(f"<small style='color:{TEXT_MUTED}'>MORAES Leather © 2026</small>", unsafe_allow_html=True)
 
-def filtrar(df, col='Fecha'):
-    if mes_sel == "Todos" or df.empty or col not in df.columns:
+def si_vacio(valor):
+    """Decorador: con un DataFrame vacío devuelve `valor` sin ejecutar la función."""
+    def decorador(fn):
+        @wraps(fn)
+        def envuelta(df, *args):
+            return valor if df.empty else fn(df, *args)
+        return envuelta
+    return decorador
+
+@si_vacio(pd.Series(dtype=float))
+def por_canal(df, col):
+    """Suma `col` por Canal en una sola pasada; se lee con .get('Amazon', 0)."""
+    return df.groupby('Canal', observed=True)[col].sum()
+
+@si_vacio((0, 0))
+def gastos_por_canal(df, pct_amz):
+    """Costos Tipo='Directo' por canal (Amazon, Directo); 'Ambos' se prorratea con pct_amz."""
+    # un solo groupby en vez de tres filtros Amazon/Directo/Ambos
+    g = df[df['Tipo']=='Directo'].groupby('Canal', observed=True)['Monto Total (USD)'].sum()
+    ambos = g.get('Ambos', 0)
+    return g.get('Amazon', 0) + ambos * pct_amz, g.get('Directo', 0) + ambos * (1 - pct_amz)
+
+def filtrar(df):
+    if mes_sel == "Todos" or df.empty:
         return df
-    return df[df[col].astype(str).str.contains(mes_sel.split()[0], case=False, na=False)]
+    # _fecha = Fecha en minúsculas, precalculada en el loader: búsqueda literal sin regex
+    return df[df['_fecha'].str.contains(mes_sel.split()[0].lower(), regex=False, na=False)]
 
 df_g = filtrar(df_gastos)
 df_v = filtrar(df_ventas)
@@ -425,39 +636,37 @@ df_v = filtrar(df_ventas)
 proyectado = st.session_state.get('proy_toggle', False)
 
 # Ventas cobradas (caja real) vs por cobrar (comprometido)
-df_v_cob = df_v[df_v['Cobrado']] if not df_v.empty and 'Cobrado' in df_v.columns else df_v
+# (cargar_ventas garantiza Cobrado, cargar_gastos_operativos Canal/Tipo/Pagado/En inventario
+# y cargar_inventario Canal: basta con chequear si el DataFrame está vacío)
+df_v_cob = df_v[df_v['Cobrado']] if not df_v.empty else df_v
 # Fuentes según escenario: en proyectado se asume todo cobrado / todo pagado
 df_v_ing = df_v if proyectado else df_v_cob
-_df_g_base = df_g if proyectado else (df_g[df_g['Pagado']] if not df_g.empty else df_g)
 # Siempre excluir costos de inventario no vendido del P&L y canales
 # (independiente del Proyectado — esos costos se activan manualmente cuando se vende)
-df_g_pag = (
-    _df_g_base[~_df_g_base['En inventario']]
-    if not _df_g_base.empty and 'En inventario' in _df_g_base.columns
-    else _df_g_base
-)
+# Una sola máscara combinada → un solo filtrado del DataFrame
+if not df_g.empty:
+    _mask_g = ~df_g['En inventario'] if proyectado else (df_g['Pagado'] & ~df_g['En inventario'])
+    df_g_pag = df_g[_mask_g]
+else:
+    df_g_pag = df_g
 
 total_ingresos      = df_v_ing['Total (USD)'].sum() if not df_v_ing.empty else 0
-ingresos_por_cobrar = 0 if proyectado else (df_v[~df_v['Cobrado']]['Total (USD)'].sum() if (not df_v.empty and 'Cobrado' in df_v.columns) else 0)
+ingresos_por_cobrar = 0 if proyectado else (df_v[~df_v['Cobrado']]['Total (USD)'].sum() if not df_v.empty else 0)
 total_gastos_pag    = df_g_pag['Monto Total (USD)'].sum() if not df_g_pag.empty else 0
 pendientes          = 0 if proyectado else (df_g[~df_g['Pagado']]['Monto Total (USD)'].sum() if not df_g.empty else 0)
 utilidad_total      = total_ingresos - total_gastos_pag
 rentabilidad_total  = (utilidad_total / total_ingresos * 100) if total_ingresos else 0
 
-amazon_ing          = df_v_ing[df_v_ing['Canal']=='Amazon']['Total (USD)'].sum() if not df_v_ing.empty else 0
-directo_ing         = df_v_ing[df_v_ing['Canal']=='Directo']['Total (USD)'].sum() if not df_v_ing.empty else 0
+_ing_canal          = por_canal(df_v_ing, 'Total (USD)')
+amazon_ing          = _ing_canal.get('Amazon', 0)
+directo_ing         = _ing_canal.get('Directo', 0)
 gastos_amazon_total = df_amazon['Monto (USD)'].sum() if not df_amazon.empty else 0
 
 # Gastos por canal: solo Tipo='Directo' (COGS, envíos, empaques producto)
 # Estructura queda a nivel empresa en el P&L — no se carga a canales
 _pct_amz = (amazon_ing / (amazon_ing + directo_ing)) if (amazon_ing + directo_ing) else 0.5
-if not df_g_pag.empty and 'Canal' in df_g_pag.columns and 'Tipo' in df_g_pag.columns:
-    _dg_canal = df_g_pag[df_g_pag['Tipo']=='Directo']  # solo costos directos
-    _g_amazon  = _dg_canal[_dg_canal['Canal']=='Amazon']['Monto Total (USD)'].sum()
-    _g_directo = _dg_canal[_dg_canal['Canal']=='Directo']['Monto Total (USD)'].sum()
-    _g_ambos   = _dg_canal[_dg_canal['Canal']=='Ambos']['Monto Total (USD)'].sum()
-    gastos_canal_amazon  = _g_amazon  + _g_ambos * _pct_amz
-    gastos_no_amazon     = _g_directo + _g_ambos * (1 - _pct_amz)
+if not df_g_pag.empty:
+    gastos_canal_amazon, gastos_no_amazon = gastos_por_canal(df_g_pag, _pct_amz)
 else:
     gastos_canal_amazon  = 0
     gastos_no_amazon     = total_gastos_pag - abs(gastos_amazon_total)
@@ -470,9 +679,11 @@ rentabilidad_directo = (neto_directo / directo_ing * 100) if directo_ing else 0
 # ── P&L en dos niveles: Margen de Contribución y Utilidad Operativa ──
 # Costos directos = gastos Tipo='Directo' (COGS, envíos, empaques producto)
 # Gastos estructura = gastos Tipo='Estructura' (equipos, logos, dominios, marketing)
-if not df_g_pag.empty and 'Tipo' in df_g_pag.columns:
-    costos_directos   = df_g_pag[df_g_pag['Tipo']=='Directo']['Monto Total (USD)'].sum()
-    gastos_estructura = df_g_pag[df_g_pag['Tipo']=='Estructura']['Monto Total (USD)'].sum()
+if not df_g_pag.empty:
+    # un solo groupby por Tipo en vez de un filtro por cada tipo
+    _por_tipo         = df_g_pag.groupby('Tipo', observed=True)['Monto Total (USD)'].sum()
+    costos_directos   = _por_tipo.get('Directo', 0)
+    gastos_estructura = _por_tipo.get('Estructura', 0)
 else:
     costos_directos   = total_gastos_pag
     gastos_estructura = 0
@@ -484,37 +695,32 @@ utilidad_operativa_pct  = (utilidad_operativa / total_ingresos * 100) if total_i
 # Ganancia potencial del inventario — siempre con rentabilidad limpia
 # (accrual: pagado + sin inventario pendiente + sin proyectado)
 # independiente de los toggles, para no distorsionar con gastos futuros
-_dg_limpio = df_gastos.copy() if not df_gastos.empty else pd.DataFrame()
-if not _dg_limpio.empty:
-    _dg_limpio = _dg_limpio[_dg_limpio['Pagado']]
-    if 'En inventario' in _dg_limpio.columns:
-        _dg_limpio = _dg_limpio[~_dg_limpio['En inventario']]
-_amz_ing_l   = df_ventas[df_ventas['Canal']=='Amazon']['Total (USD)'].sum() if not df_ventas.empty and 'Cobrado' not in df_ventas.columns else (df_ventas[df_ventas['Cobrado'] & (df_ventas['Canal']=='Amazon')]['Total (USD)'].sum() if not df_ventas.empty else 0)
-_dir_ing_l   = df_ventas[df_ventas['Canal']=='Directo']['Total (USD)'].sum() if not df_ventas.empty and 'Cobrado' not in df_ventas.columns else (df_ventas[df_ventas['Cobrado'] & (df_ventas['Canal']=='Directo')]['Total (USD)'].sum() if not df_ventas.empty else 0)
-# usar ventas cobradas para la rentabilidad limpia
-_dv_cob      = df_ventas[df_ventas['Cobrado']] if not df_ventas.empty and 'Cobrado' in df_ventas.columns else df_ventas
-_amz_ing_l   = _dv_cob[_dv_cob['Canal']=='Amazon']['Total (USD)'].sum()  if not _dv_cob.empty else 0
-_dir_ing_l   = _dv_cob[_dv_cob['Canal']=='Directo']['Total (USD)'].sum() if not _dv_cob.empty else 0
-_pct_amz_l   = (_amz_ing_l / (_amz_ing_l + _dir_ing_l)) if (_amz_ing_l + _dir_ing_l) else 0.5
-if not _dg_limpio.empty and 'Canal' in _dg_limpio.columns and 'Tipo' in _dg_limpio.columns:
-    _dc_l    = _dg_limpio[_dg_limpio['Tipo']=='Directo']
-    _ga_l    = _dc_l[_dc_l['Canal']=='Amazon']['Monto Total (USD)'].sum()
-    _gd_l    = _dc_l[_dc_l['Canal']=='Directo']['Monto Total (USD)'].sum()
-    _gab_l   = _dc_l[_dc_l['Canal']=='Ambos']['Monto Total (USD)'].sum()
-    _gc_amz_l = _ga_l + _gab_l * _pct_amz_l
-    _gc_dir_l = _gd_l + _gab_l * (1 - _pct_amz_l)
-else:
-    _gc_amz_l = 0; _gc_dir_l = 0
-_fees_l       = df_amazon['Monto (USD)'].sum() if not df_amazon.empty else 0
-_neto_amz_l   = _amz_ing_l + _fees_l - _gc_amz_l
-_neto_dir_l   = _dir_ing_l - _gc_dir_l
-_ra_limpio    = (_neto_amz_l / _amz_ing_l)  if _amz_ing_l  else 0
-_rd_limpio    = (_neto_dir_l / _dir_ing_l)  if _dir_ing_l  else 0
-
-if not df_inv.empty and 'Canal' in df_inv.columns:
-    inv_gan_potencial = df_inv.apply(
-        lambda r: r['Valor a Mercado (USD)'] * (_ra_limpio if r.get('Canal','Directo')=='Amazon' else _rd_limpio), axis=1
-    ).sum()
+def rentabilidad_limpia(df_gastos, df_ventas, df_amazon):
+    # (cargar_gastos_operativos garantiza las columnas Pagado y En inventario)
+    _dg_limpio = df_gastos[df_gastos['Pagado'] & ~df_gastos['En inventario']] if not df_gastos.empty else df_gastos
+    # usar ventas cobradas para la rentabilidad limpia
+    _dv_cob      = df_ventas[df_ventas['Cobrado']] if not df_ventas.empty else df_ventas
+    _ing_canal_l = por_canal(_dv_cob, 'Total (USD)')
+    _amz_ing_l   = _ing_canal_l.get('Amazon', 0)
+    _dir_ing_l   = _ing_canal_l.get('Directo', 0)
+    _pct_amz_l   = (_amz_ing_l / (_amz_ing_l + _dir_ing_l)) if (_amz_ing_l + _dir_ing_l) else 0.5
+    _gc_amz_l, _gc_dir_l = gastos_por_canal(_dg_limpio, _pct_amz_l)
+    _fees_l       = df_amazon['Monto (USD)'].sum() if not df_amazon.empty else 0
+    _neto_amz_l   = _amz_ing_l + _fees_l - _gc_amz_l
+    _neto_dir_l   = _dir_ing_l - _gc_dir_l
+    _ra_limpio    = (_neto_amz_l / _amz_ing_l)  if _amz_ing_l  else 0
+    _rd_limpio    = (_neto_dir_l / _dir_ing_l)  if _dir_ing_l  else 0
+    return _ra_limpio, _rd_limpio
+
+_ra_limpio, _rd_limpio = rentabilidad_limpia(df_gastos, df_ventas, df_amazon)
+
+# columna de ganancia potencial y totales del inventario: se calculan una vez
+# aquí y los reutilizan el KPI principal y la sección Inventario
+if not df_inv.empty:
+    df_inv['Ganancia Potencial (USD)'] = (
+        df_inv['Valor a Mercado (USD)'] * np.where(df_inv['Canal']=='Amazon', _ra_limpio, _rd_limpio)
+    )
+    inv_gan_potencial = df_inv['Ganancia Potencial (USD)'].sum()
     inv_mercado_total = df_inv['Valor a Mercado (USD)'].sum()
     inv_uds_total     = int(df_inv['Stock (ajustable)'].sum())
 else:
@@ -522,11 +728,16 @@ else:
     inv_mercado_total = 0
     inv_uds_total     = 0
 
-unidades_amazon  = int(df_v[df_v['Canal']=='Amazon']['Unidades'].sum()) if not df_v.empty else 0
-unidades_directo = int(df_v[df_v['Canal']=='Directo']['Unidades'].sum()) if not df_v.empty else 0
-# mezcla por canal sobre TODAS las ventas (actividad comercial, no caja)
+# unidades y mezcla por canal sobre TODAS las ventas (actividad comercial, no caja):
+# un solo groupby para las dos columnas
+_v_canal = (
+    df_v.groupby('Canal', observed=True)[['Unidades', 'Total (USD)']].sum()
+    if not df_v.empty else pd.DataFrame(columns=['Unidades', 'Total (USD)'])
+).reindex(['Amazon', 'Directo'], fill_value=0)
+unidades_amazon  = int(_v_canal.at['Amazon', 'Unidades'])
+unidades_directo = int(_v_canal.at['Directo', 'Unidades'])
 ventas_tot_all   = df_v['Total (USD)'].sum() if not df_v.empty else 0
-amazon_ing_all   = df_v[df_v['Canal']=='Amazon']['Total (USD)'].sum() if not df_v.empty else 0
+amazon_ing_all   = _v_canal.at['Amazon', 'Total (USD)']
 amazon_pct       = (amazon_ing_all / ventas_tot_all * 100) if ventas_tot_all else 0
 
 # ── Header ────────────────────────────────────────────────────────
@@ -555,18 +766,21 @@ with _tg2:
     st.toggle("🔮 Proyectado (todo cobrado y pagado)", key="proy_toggle",
               help="Asume que se cobraron todas las ventas y se pagaron todos los gastos pendientes.")
 
-def dash_table(df):
+def fmt_usd(x):
+    return f"${x:,.2f}"
+
+def dash_table(df, formatters=None):
     """Renderiza un DataFrame como tabla HTML con estilo del dashboard."""
+    # formatters se aplica al generar el HTML: las columnas siguen siendo numéricas
     return st.write(
         '<div style="overflow-x:auto;">' +
-        df.to_html(classes='dash-table', index=False, escape=False, border=0) +
+        df.to_html(classes='dash-table', index=False, escape=False, border=0, formatters=formatters) +
         '</div>',
         unsafe_allow_html=True
     )
 
 # ── P&L en cascada ───────────────────────────────────────────────
 st.markdown('<p class="section-label">P&L — Estado de resultados</p>', unsafe_allow_html=True)
-st.markdown('<div class="chart-card">', unsafe_allow_html=True)
 
 def _pct_bar(pct, color):
     w = min(abs(pct), 100)
@@ -587,14 +801,16 @@ def _pl_row(label, valor, pct, color, bold=False, indent=0, divider=False):
   <span style="flex:0 0 60px;text-align:right;font-family:Manrope,sans-serif;font-size:0.75rem;color:#a08070;">{pct_s}</span>
 </div>'''
 
-html  = _pl_row("Ingresos cobrados",         total_ingresos,         100,                    GOLD,  bold=True)
+html  = '<div class="chart-card">'
+html += _pl_row("Ingresos cobrados",         total_ingresos,         100,                    GOLD,  bold=True)
 html += _pl_row("− Costos directos",          -costos_directos,       -costos_directos/total_ingresos*100 if total_ingresos else 0, RED,   indent=1)
 html += _pl_row("= Margen de contribución",   margen_contribucion,    margen_contribucion_pct,GREEN if margen_contribucion>=0 else RED, bold=True, divider=True)
 html += _pl_row("− Gastos de estructura",     -gastos_estructura,     -gastos_estructura/total_ingresos*100 if total_ingresos else 0, RED,   indent=1)
 html += _pl_row("= Utilidad operativa",       utilidad_operativa,     utilidad_operativa_pct, GREEN if utilidad_operativa>=0 else RED, bold=True, divider=True)
+html += '</div>'
 
+# tarjeta y filas del P&L en un solo elemento
 st.markdown(html, unsafe_allow_html=True)
-st.markdown('</div>', unsafe_allow_html=True)
 st.markdown("<div style='height:8px'></div>", unsafe_allow_html=True)
 
 # ── Fila 1: KPIs principales ──────────────────────────────────────
@@ -608,140 +824,130 @@ def badge(val, fmt="pct"):
     cls = "badge-green" if val >= 0 else "badge-red"
     return f'<span class="kpi-badge {cls}">{txt}</span>'
 
-st.markdown('<div class="mobile-kpi-grid">', unsafe_allow_html=True)
-k1, k2, k3, k4, k5 = st.columns(5)
-
-with k1:
-    st.markdown(f"""
-    <div class="kpi-card kpi-card-top" style="border-top-color:{GOLD};">
-      <div class="kpi-icon">💰</div>
-      <div class="kpi-label">{'Ingresos proyectados' if proyectado else 'Ingresos cobrados'}</div>
-      <div class="kpi-value" style="color:{GOLD};">${total_ingresos:,.2f}</div>
-      <div class="kpi-sub">Por cobrar: ${ingresos_por_cobrar:,.2f} · {unidades_amazon + unidades_directo} unidades</div>
-      <span class="kpi-badge badge-amber">Amazon {amazon_pct:.0f}% · Directo {100-amazon_pct:.0f}%</span>
-    </div>""", unsafe_allow_html=True)
-
-with k2:
-    st.markdown(f"""
-    <div class="kpi-card kpi-card-top" style="border-top-color:#f97316;">
-      <div class="kpi-icon">📤</div>
-      <div class="kpi-label">Gastos pagados</div>
-      <div class="kpi-value" style="color:#f97316;">${total_gastos_pag:,.2f}</div>
-      <div class="kpi-sub">Pendientes: ${pendientes:,.2f}</div>
-      <span class="kpi-badge badge-amber">Fees Amazon ${abs(gastos_amazon_total):,.0f}</span>
-    </div>""", unsafe_allow_html=True)
-
-with k3:
-    c = GREEN if utilidad_total >= 0 else RED
-    st.markdown(f"""
-    <div class="kpi-card kpi-card-top" style="border-top-color:{c};">
-      <div class="kpi-icon">{'📈' if utilidad_total >= 0 else '📉'}</div>
-      <div class="kpi-label">Utilidad neta</div>
-      <div class="kpi-value" style="color:{c};">${utilidad_total:,.2f}</div>
-      <div class="kpi-sub">Ingresos − Gastos pagados</div>
-      {badge(rentabilidad_total)}
-    </div>""", unsafe_allow_html=True)
-
-with k4:
-    c4 = GREEN if rentabilidad_total >= 0 else RED
-    st.markdown(f"""
-    <div class="kpi-card kpi-card-top" style="border-top-color:{AMBER};">
-      <div class="kpi-icon">🎯</div>
-      <div class="kpi-label">Rentabilidad total</div>
-      <div class="kpi-value" style="color:{AMBER};">{rentabilidad_total:.1f}%</div>
-      <div class="kpi-sub">Utilidad / Ingresos cobrados</div>
-      {badge(utilidad_total, "usd")}
-    </div>""", unsafe_allow_html=True)
-
-with k5:
-    if proyectado:
-        _k5_val   = inv_gan_potencial
-        _k5_label = 'Ganancia potencial inv.'
-        _k5_sub   = f'Valor a mercado: ${inv_mercado_total:,.2f}'
-        _k5_badge = f'<span class="kpi-badge badge-amber">{inv_uds_total} uds en stock</span>'
-        _k5_color = GREEN if inv_gan_potencial >= 0 else RED
-        _k5_icon  = '📈'
-    else:
-        _k5_val   = inv_mercado_total
-        _k5_label = 'Inventario a mercado'
-        _k5_sub   = f'Gan. potencial: ${inv_gan_potencial:,.2f} · {inv_uds_total} uds'
-        _k5_badge = f'<span class="kpi-badge badge-amber">Amazon 21.7% · Directo {rentabilidad_directo:.1f}%</span>'
-        _k5_color = AMBER_DARK
-        _k5_icon  = '📦'
-    st.markdown(f"""
-    <div class="kpi-card kpi-card-top" style="border-top-color:{_k5_color};">
-      <div class="kpi-icon">{_k5_icon}</div>
-      <div class="kpi-label">{_k5_label}</div>
-      <div class="kpi-value" style="color:{_k5_color};">${_k5_val:,.2f}</div>
-      <div class="kpi-sub">{_k5_sub}</div>
-      {_k5_badge}
-    </div>""", unsafe_allow_html=True)
-
-st.markdown('</div>', unsafe_allow_html=True)
+# las 5 tarjetas se arman como HTML y se renderizan en un solo st.markdown (grid CSS)
+_kpi1 = f"""
+<div class="kpi-card kpi-card-top" style="border-top-color:{GOLD};">
+  <div class="kpi-icon">💰</div>
+  <div class="kpi-label">{'Ingresos proyectados' if proyectado else 'Ingresos cobrados'}</div>
+  <div class="kpi-value" style="color:{GOLD};">${total_ingresos:,.2f}</div>
+  <div class="kpi-sub">Por cobrar: ${ingresos_por_cobrar:,.2f} · {unidades_amazon + unidades_directo} unidades</div>
+  <span class="kpi-badge badge-amber">Amazon {amazon_pct:.0f}% · Directo {100-amazon_pct:.0f}%</span>
+</div>"""
+
+_kpi2 = f"""
+<div class="kpi-card kpi-card-top" style="border-top-color:#f97316;">
+  <div class="kpi-icon">📤</div>
+  <div class="kpi-label">Gastos pagados</div>
+  <div class="kpi-value" style="color:#f97316;">${total_gastos_pag:,.2f}</div>
+  <div class="kpi-sub">Pendientes: ${pendientes:,.2f}</div>
+  <span class="kpi-badge badge-amber">Fees Amazon ${abs(gastos_amazon_total):,.0f}</span>
+</div>"""
+
+c = GREEN if utilidad_total >= 0 else RED
+_kpi3 = f"""
+<div class="kpi-card kpi-card-top" style="border-top-color:{c};">
+  <div class="kpi-icon">{'📈' if utilidad_total >= 0 else '📉'}</div>
+  <div class="kpi-label">Utilidad neta</div>
+  <div class="kpi-value" style="color:{c};">${utilidad_total:,.2f}</div>
+  <div class="kpi-sub">Ingresos − Gastos pagados</div>
+  {badge(rentabilidad_total)}
+</div>"""
+
+c4 = GREEN if rentabilidad_total >= 0 else RED
+_kpi4 = f"""
+<div class="kpi-card kpi-card-top" style="border-top-color:{AMBER};">
+  <div class="kpi-icon">🎯</div>
+  <div class="kpi-label">Rentabilidad total</div>
+  <div class="kpi-value" style="color:{AMBER};">{rentabilidad_total:.1f}%</div>
+  <div class="kpi-sub">Utilidad / Ingresos cobrados</div>
+  {badge(utilidad_total, "usd")}
+</div>"""
+
+if proyectado:
+    _k5_val   = inv_gan_potencial
+    _k5_label = 'Ganancia potencial inv.'
+    _k5_sub   = f'Valor a mercado: ${inv_mercado_total:,.2f}'
+    _k5_badge = f'<span class="kpi-badge badge-amber">{inv_uds_total} uds en stock</span>'
+    _k5_color = GREEN if inv_gan_potencial >= 0 else RED
+    _k5_icon  = '📈'
+else:
+    _k5_val   = inv_mercado_total
+    _k5_label = 'Inventario a mercado'
+    _k5_sub   = f'Gan. potencial: ${inv_gan_potencial:,.2f} · {inv_uds_total} uds'
+    _k5_badge = f'<span class="kpi-badge badge-amber">Amazon 21.7% · Directo {rentabilidad_directo:.1f}%</span>'
+    _k5_color = AMBER_DARK
+    _k5_icon  = '📦'
+_kpi5 = f"""
+<div class="kpi-card kpi-card-top" style="border-top-color:{_k5_color};">
+  <div class="kpi-icon">{_k5_icon}</div>
+  <div class="kpi-label">{_k5_label}</div>
+  <div class="kpi-value" style="color:{_k5_color};">${_k5_val:,.2f}</div>
+  <div class="kpi-sub">{_k5_sub}</div>
+  {_k5_badge}
+</div>"""
+
+st.markdown(
+    '<div class="kpi-grid kpi-grid-5">' + _kpi1 + _kpi2 + _kpi3 + _kpi4 + _kpi5 + '</div>',
+    unsafe_allow_html=True
+)
 st.markdown("<div style='height:20px'></div>", unsafe_allow_html=True)
 
 # ── Fila 2: Canales ───────────────────────────────────────────────
-_cl, _cr = st.columns([3,1])
-with _cl:
-    st.markdown('<p class="section-label">Desglose por canal</p>', unsafe_allow_html=True)
-with _cr:
-    con_inversion = st.toggle("📦 Con inversión pendiente", key="canal_inversion",
-        help="Activa para incluir costos de inventario comprado pero aún no vendido (envíos, stock en FBA).")
-
-# Recalcular canales según el toggle local
-if con_inversion and not df_g.empty:
-    # incluir también los costos marcados como "En inventario" (pagados pero de stock sin vender)
-    _df_g_inv = df_g[df_g['Pagado']] if not proyectado else df_g
-    _dg_c = _df_g_inv[(_df_g_inv['Tipo']=='Directo')] if 'Tipo' in _df_g_inv.columns else _df_g_inv
-    _pct  = (amazon_ing/(amazon_ing+directo_ing)) if (amazon_ing+directo_ing) else 0.5
-    _ga   = _dg_c[_dg_c['Canal']=='Amazon']['Monto Total (USD)'].sum()
-    _gd   = _dg_c[_dg_c['Canal']=='Directo']['Monto Total (USD)'].sum()
-    _gab  = _dg_c[_dg_c['Canal']=='Ambos']['Monto Total (USD)'].sum()
-    _gastos_amz_c = _ga  + _gab * _pct
-    _gastos_dir_c = _gd  + _gab * (1 - _pct)
-    _neto_amz  = amazon_ing + gastos_amazon_total - _gastos_amz_c
-    _neto_dir  = directo_ing - _gastos_dir_c
-    _rent_amz  = (_neto_amz  / amazon_ing  * 100) if amazon_ing  else 0
-    _rent_dir  = (_neto_dir  / directo_ing * 100) if directo_ing else 0
-    _modo_label = '📦 Con inversión'
-else:
-    _neto_amz  = neto_amazon;        _rent_amz  = rentabilidad_amazon
-    _neto_dir  = neto_directo;       _rent_dir  = rentabilidad_directo
-    _gastos_amz_c = gastos_canal_amazon; _gastos_dir_c = gastos_no_amazon
-    _modo_label = '✅ Sin inv. pendiente'
-
-# En Proyectado: Amazon incluye venta proyectada del inventario en stock
-if proyectado and not df_inv.empty and 'Canal' in df_inv.columns:
-    _amz_inv       = df_inv[df_inv['Canal']=='Amazon']
-    _amz_inv_rev   = (_amz_inv['Stock (ajustable)'] * _amz_inv['Precio Mercado (USD)']).sum()
-    _fee_pct       = abs(gastos_amazon_total) / amazon_ing if amazon_ing else 0.445
-    _amz_inv_fees  = _amz_inv_rev * _fee_pct
-    # costos En inventario (pagados y pendientes) para Amazon
-    _dg_einv = df_gastos[df_gastos['En inventario'] & (df_gastos['Canal']=='Amazon')] if not df_gastos.empty and 'En inventario' in df_gastos.columns else pd.DataFrame()
-    _amz_inv_costs = _dg_einv['Monto Total (USD)'].sum() if not _dg_einv.empty else 0
-    _amz_ing_proy      = amazon_ing + _amz_inv_rev
-    _amz_fees_proy     = gastos_amazon_total - _amz_inv_fees   # negativo
-    _amz_gastos_proy   = _gastos_amz_c + _amz_inv_costs
-    _neto_amz_proy     = _amz_ing_proy + _amz_fees_proy - _amz_gastos_proy
-    _rent_amz_proy     = (_neto_amz_proy / _amz_ing_proy * 100) if _amz_ing_proy else 0
-    _show_amz_ing      = _amz_ing_proy
-    _show_amz_costos   = _amz_gastos_proy + abs(_amz_fees_proy)
-    _show_neto_amz     = _neto_amz_proy
-    _show_rent_amz     = _rent_amz_proy
-    _amz_uds_label     = f'{unidades_amazon} vendidas + {int(_amz_inv["Stock (ajustable)"].sum())} en stock'
-else:
-    _show_amz_ing    = amazon_ing
-    _show_amz_costos = _gastos_amz_c + abs(gastos_amazon_total)
-    _show_neto_amz   = _neto_amz
-    _show_rent_amz   = _rent_amz
-    _amz_uds_label   = f'{unidades_amazon} unidades'
-
-st.markdown('<div class="mobile-canal-grid">', unsafe_allow_html=True)
-c1, c2, c3 = st.columns(3)
+# Fragmento: el toggle 'Con inversión' solo re-ejecuta esta sección, no todo el dashboard
+@st.fragment
+def seccion_canales():
+    _cl, _cr = st.columns([3,1])
+    with _cl:
+        st.markdown('<p class="section-label">Desglose por canal</p>', unsafe_allow_html=True)
+    with _cr:
+        con_inversion = st.toggle("📦 Con inversión pendiente", key="canal_inversion",
+            help="Activa para incluir costos de inventario comprado pero aún no vendido (envíos, stock en FBA).")
+
+    # Recalcular canales según el toggle local
+    if con_inversion and not df_g.empty:
+        # incluir también los costos marcados como "En inventario" (pagados pero de stock sin vender)
+        _df_g_inv = df_g[df_g['Pagado']] if not proyectado else df_g
+        _gastos_amz_c, _gastos_dir_c = gastos_por_canal(_df_g_inv, _pct_amz)
+        _neto_amz  = amazon_ing + gastos_amazon_total - _gastos_amz_c
+        _neto_dir  = directo_ing - _gastos_dir_c
+        _rent_amz  = (_neto_amz  / amazon_ing  * 100) if amazon_ing  else 0
+        _rent_dir  = (_neto_dir  / directo_ing * 100) if directo_ing else 0
+        _modo_label = '📦 Con inversión'
+    else:
+        _neto_amz  = neto_amazon;        _rent_amz  = rentabilidad_amazon
+        _neto_dir  = neto_directo;       _rent_dir  = rentabilidad_directo
+        _gastos_amz_c = gastos_canal_amazon; _gastos_dir_c = gastos_no_amazon
+        _modo_label = '✅ Sin inv. pendiente'
+
+    # En Proyectado: Amazon incluye venta proyectada del inventario en stock
+    if proyectado and not df_inv.empty:
+        _amz_inv       = df_inv[df_inv['Canal']=='Amazon']
+        _amz_inv_rev   = (_amz_inv['Stock (ajustable)'] * _amz_inv['Precio Mercado (USD)']).sum()
+        _fee_pct       = abs(gastos_amazon_total) / amazon_ing if amazon_ing else 0.445
+        _amz_inv_fees  = _amz_inv_rev * _fee_pct
+        # costos En inventario (pagados y pendientes) para Amazon
+        _dg_einv = df_gastos[df_gastos['En inventario'] & (df_gastos['Canal']=='Amazon')] if not df_gastos.empty else pd.DataFrame()
+        _amz_inv_costs = _dg_einv['Monto Total (USD)'].sum() if not _dg_einv.empty else 0
+        _amz_ing_proy      = amazon_ing + _amz_inv_rev
+        _amz_fees_proy     = gastos_amazon_total - _amz_inv_fees   # negativo
+        _amz_gastos_proy   = _gastos_amz_c + _amz_inv_costs
+        _neto_amz_proy     = _amz_ing_proy + _amz_fees_proy - _amz_gastos_proy
+        _rent_amz_proy     = (_neto_amz_proy / _amz_ing_proy * 100) if _amz_ing_proy else 0
+        _show_amz_ing      = _amz_ing_proy
+        _show_amz_costos   = _amz_gastos_proy + abs(_amz_fees_proy)
+        _show_neto_amz     = _neto_amz_proy
+        _show_rent_amz     = _rent_amz_proy
+        _amz_uds_label     = f'{unidades_amazon} vendidas + {int(_amz_inv["Stock (ajustable)"].sum())} en stock'
+    else:
+        _show_amz_ing    = amazon_ing
+        _show_amz_costos = _gastos_amz_c + abs(gastos_amazon_total)
+        _show_neto_amz   = _neto_amz
+        _show_rent_amz   = _rent_amz
+        _amz_uds_label   = f'{unidades_amazon} unidades'
 
-with c1:
+    # las 3 tarjetas en un solo st.markdown (grid CSS) en vez de 3 columnas
     rc = GREEN if _show_rent_amz >= 0 else RED
-    st.markdown(f"""
+    _canal1 = f"""
     <div class="canal-card" style="border-top: 3px solid {CH_AMAZON};">
       <div class="canal-name">🟠 Canal Amazon{'&nbsp;&nbsp;<span style="font-size:0.65rem;background:#3d1f0a;color:#fb923c;padding:2px 7px;border-radius:10px;border:1px solid #5a3010;">🔮 Proyectado</span>' if proyectado else ''}</div>
       <div class="canal-value" style="color:{CH_AMAZON};">${_show_amz_ing:,.2f}</div>
@@ -761,11 +967,10 @@ with c1:
           <div class="canal-stat-value" style="color:{rc};">{_show_rent_amz:.1f}%</div>
         </div>
       </div>
-    </div>""", unsafe_allow_html=True)
+    </div>"""
 
-with c2:
     rd = GREEN if _rent_dir >= 0 else RED
-    st.markdown(f"""
+    _canal2 = f"""
     <div class="canal-card" style="border-top: 3px solid {CH_DIRECTO};">
       <div class="canal-name">🟡 Canal Directo</div>
       <div class="canal-value" style="color:{CH_DIRECTO};">${directo_ing:,.2f}</div>
@@ -785,10 +990,9 @@ with c2:
           <div class="canal-stat-value" style="color:{rd};">{_rent_dir:.1f}%</div>
         </div>
       </div>
-    </div>""", unsafe_allow_html=True)
+    </div>"""
 
-with c3:
-    st.markdown(f"""
+    _canal3 = f"""
     <div class="canal-card" style="border-top: 3px solid {AMBER};">
       <div class="canal-name">🦎 Comparativa de canales</div>
       <div style="margin-top:12px;">
@@ -815,20 +1019,30 @@ with c3:
           <span style="font-weight:600;color:{'#4ade80' if _rent_dir>=0 else '#f87171'};">{_rent_dir:.1f}%</span>
         </div>
       </div>
-    </div>""", unsafe_allow_html=True)
+    </div>"""
 
-st.markdown('</div>', unsafe_allow_html=True)
-st.markdown("<div style='height:24px'></div>", unsafe_allow_html=True)
+    st.markdown(
+        '<div class="kpi-grid canal-grid">' + _canal1 + _canal2 + _canal3 + '</div>',
+        unsafe_allow_html=True
+    )
+    st.markdown("<div style='height:24px'></div>", unsafe_allow_html=True)
+
+seccion_canales()
 
 # ── Fila 3: Gráficos ──────────────────────────────────────────────
 st.markdown('<p class="section-label">Análisis visual</p>', unsafe_allow_html=True)
 
-PLOTLY_LAYOUT = dict(
-    paper_bgcolor='rgba(0,0,0,0)',
-    plot_bgcolor='rgba(0,0,0,0)',
-    font=dict(family='Inter', color=TEXT_MUTED, size=11),
-    margin=dict(t=10, b=10, l=10, r=10),
-)
+def datos_graficos(df_v, df_g):
+    """Agregados de los gráficos (canal, categoría de gasto y SKU) sobre los datos filtrados."""
+    canal = por_canal(df_v, 'Total (USD)')
+    cat = (
+        df_g[df_g['Monto Total (USD)'] > 0].groupby('Categoría', observed=True)['Monto Total (USD)'].sum().sort_values()
+        if not df_g.empty and 'Categoría' in df_g.columns else pd.Series(dtype=float)
+    )
+    prod = df_v.groupby('SKU', observed=True, sort=False)['Total (USD)'].sum().sort_values() if not df_v.empty else pd.Series(dtype=float)
+    return canal, cat, prod
+
+canal_data, cat_data, prod_data = datos_graficos(df_v, df_g)
 
 st.markdown('<div class="mobile-hidden">', unsafe_allow_html=True)
 g1, g2 = st.columns(2)
@@ -836,10 +1050,10 @@ g1, g2 = st.columns(2)
 with g1:
     st.markdown('<div class="chart-card"><div class="chart-title">Ventas por canal</div>', unsafe_allow_html=True)
     if not df_v.empty:
-        canal_data = df_v.groupby('Canal')['Total (USD)'].sum().reset_index()
-        fig = px.pie(canal_data, values='Total (USD)', names='Canal',
-                     color='Canal', color_discrete_map={'Amazon': CH_AMAZON, 'Directo': CH_DIRECTO},
-                     hole=0.55)
+        # trazas go directas sobre el agregado: sin la introspección de DataFrame de px
+        canales = canal_data.index.astype(str)
+        fig = go.Figure(go.Pie(labels=canales, values=canal_data.to_numpy(), hole=0.55,
+                               marker=dict(colors=[{'Amazon': CH_AMAZON, 'Directo': CH_DIRECTO}.get(c, AMBER) for c in canales])))
         fig.update_traces(textposition='outside', textinfo='label+percent',
                           textfont=dict(size=11, color=TEXT_MAIN),
                           marker=dict(line=dict(color=SURFACE, width=2)))
@@ -850,13 +1064,10 @@ with g1:
 with g2:
     st.markdown('<div class="chart-card"><div class="chart-title">Gastos operativos por categoría</div>', unsafe_allow_html=True)
     if not df_g.empty:
-        cat_col = next((c for c in df_g.columns if 'categor' in c.lower()), None)
-        if cat_col:
-            cat_data = df_g[df_g['Monto Total (USD)'] > 0].groupby(cat_col)['Monto Total (USD)'].sum().reset_index()
-            cat_data = cat_data.sort_values('Monto Total (USD)', ascending=True)
-            palette = CHART_SEQ
-            fig2 = px.bar(cat_data, x='Monto Total (USD)', y=cat_col, orientation='h',
-                          color=cat_col, color_discrete_sequence=palette)
+        if 'Categoría' in df_g.columns:
+            palette = [CHART_SEQ[i % len(CHART_SEQ)] for i in range(len(cat_data))]
+            fig2 = go.Figure(go.Bar(x=cat_data.to_numpy(), y=cat_data.index.to_numpy(), orientation='h',
+                                    marker_color=palette))
             fig2.update_layout(**PLOTLY_LAYOUT, height=260, showlegend=False,
                                xaxis=dict(gridcolor=CARD_BORDER, zeroline=False),
                                yaxis=dict(gridcolor='rgba(0,0,0,0)'))
@@ -869,11 +1080,10 @@ g3, g4 = st.columns(2)
 
 with g3:
     st.markdown('<div class="chart-card"><div class="chart-title">Ingresos por producto (SKU)</div>', unsafe_allow_html=True)
-    if not df_v.empty and 'SKU' in df_v.columns:
-        prod_data = df_v.groupby('SKU')['Total (USD)'].sum().reset_index().sort_values('Total (USD)', ascending=True)
-        prod_data['SKU'] = prod_data['SKU'].astype(str)  # tratar SKU como categoría, no número
-        fig3 = px.bar(prod_data, x='Total (USD)', y='SKU', orientation='h',
-                      color_discrete_sequence=[AMBER])
+    if not df_v.empty:
+        # SKU como texto: el eje se trata como categoría, no número
+        fig3 = go.Figure(go.Bar(x=prod_data.to_numpy(), y=prod_data.index.astype(str), orientation='h',
+                                marker_color=AMBER))
         fig3.update_layout(**PLOTLY_LAYOUT, height=240, showlegend=False,
                            xaxis=dict(gridcolor=CARD_BORDER, zeroline=False),
                            yaxis=dict(gridcolor='rgba(0,0,0,0)', type='category'))
@@ -905,13 +1115,12 @@ st.markdown("<div style='height:8px'></div>", unsafe_allow_html=True)
 st.markdown('<p class="section-label">Pagos pendientes</p>', unsafe_allow_html=True)
 st.markdown('<div class="chart-card">', unsafe_allow_html=True)
 if not df_g.empty:
-    pdf = df_g[~df_g['Pagado']].copy()
+    # filas y columnas en un solo .loc: sin copia intermedia del frame completo
+    cols_show = [c for c in ['Fecha','Descripción','Categoría','Monto Total (USD)','Notas'] if c in df_g.columns]
+    pdf = df_g.loc[~df_g['Pagado'], cols_show]
     if not pdf.empty:
-        cols_show = [c for c in ['Fecha','Descripción','Categoría','Monto Total (USD)','Notas'] if c in pdf.columns]
-        pdf = pdf[cols_show]
-        pdf['Monto Total (USD)'] = pdf['Monto Total (USD)'].apply(lambda x: f"${x:,.2f}")
         pdf = pdf.rename(columns={'Monto Total (USD)': 'Monto (USD)'})
-        dash_table(pdf)
+        dash_table(pdf, formatters={'Monto (USD)': fmt_usd})
         st.markdown(f"<p style='color:{RED};font-weight:600;margin-top:8px;'>Total pendiente: ${pendientes:,.2f}</p>", unsafe_allow_html=True)
     else:
         st.markdown(f"<p style='color:{GREEN};'>✓ Sin pagos pendientes para este período.</p>", unsafe_allow_html=True)
@@ -920,13 +1129,10 @@ st.markdown('</div>', unsafe_allow_html=True)
 # ── Cuentas por cobrar ────────────────────────────────────────────
 st.markdown('<p class="section-label">Cuentas por cobrar</p>', unsafe_allow_html=True)
 st.markdown('<div class="chart-card">', unsafe_allow_html=True)
-if not df_v.empty and 'Cobrado' in df_v.columns:
-    cdf = df_v[~df_v['Cobrado']].copy()
+if not df_v.empty:
+    cdf = df_v.loc[~df_v['Cobrado'], ['Fecha','Producto','SKU','Canal','Total (USD)','Notas']]
     if not cdf.empty:
-        cols_show = [c for c in ['Fecha','Producto','SKU','Canal','Total (USD)','Notas'] if c in cdf.columns]
-        cdf = cdf[cols_show]
-        cdf['Total (USD)'] = cdf['Total (USD)'].apply(lambda x: f"${x:,.2f}")
-        dash_table(cdf)
+        dash_table(cdf, formatters={'Total (USD)': fmt_usd})
         st.markdown(f"<p style='color:{RED};font-weight:600;margin-top:8px;'>Total por cobrar: ${ingresos_por_cobrar:,.2f}</p>", unsafe_allow_html=True)
     else:
         st.markdown(f"<p style='color:{GREEN};'>✓ Sin cuentas por cobrar para este período.</p>", unsafe_allow_html=True)
@@ -937,74 +1143,71 @@ st.markdown('<p class="section-label">Inventario en stock</p>', unsafe_allow_htm
 
 if not df_inv.empty:
     # Ganancia potencial real = valor a mercado × rentabilidad limpia por canal
-    # Usa siempre _ra_limpio/_rd_limpio (accrual, sin proyectado ni inversión pendiente)
-    df_inv = df_inv.copy()
-    df_inv['Ganancia Potencial (USD)'] = df_inv.apply(
-        lambda r: r['Valor a Mercado (USD)'] * (_ra_limpio if r.get('Canal','Directo')=='Amazon' else _rd_limpio),
-        axis=1
-    )
-
+    # (columna y totales ya calculados junto al KPI principal)
     inv_capital   = df_inv['Valor en Stock (USD)'].sum()
-    inv_mercado   = df_inv['Valor a Mercado (USD)'].sum()
-    inv_ganancia  = df_inv['Ganancia Potencial (USD)'].sum()
-    inv_unidades  = int(df_inv['Stock (ajustable)'].sum())
+    inv_mercado   = inv_mercado_total
+    inv_ganancia  = inv_gan_potencial
+    inv_unidades  = inv_uds_total
     inv_margen    = (inv_ganancia / inv_mercado * 100) if inv_mercado else 0
 
-    st.markdown('<div class="mobile-inv-grid">', unsafe_allow_html=True)
-    ki1, ki2, ki3 = st.columns(3)
-    with ki1:
-        st.markdown(f"""
-        <div class="kpi-card kpi-card-top" style="border-top-color:{AMBER};">
-          <div class="kpi-icon">📦</div>
-          <div class="kpi-label">Capital en stock (costo)</div>
-          <div class="kpi-value" style="color:{AMBER};">${inv_capital:,.2f}</div>
-          <div class="kpi-sub">{inv_unidades} unidades en stock</div>
-        </div>""", unsafe_allow_html=True)
-    with ki2:
-        st.markdown(f"""
-        <div class="kpi-card kpi-card-top" style="border-top-color:{GOLD};">
-          <div class="kpi-icon">💎</div>
-          <div class="kpi-label">Valor a mercado</div>
-          <div class="kpi-value" style="color:{GOLD};">${inv_mercado:,.2f}</div>
-          <div class="kpi-sub">Si se vende todo el stock actual</div>
-        </div>""", unsafe_allow_html=True)
-    with ki3:
-        cg = GREEN if inv_ganancia >= 0 else RED
-        st.markdown(f"""
-        <div class="kpi-card kpi-card-top" style="border-top-color:{cg};">
-          <div class="kpi-icon">{'📈' if inv_ganancia >= 0 else '📉'}</div>
-          <div class="kpi-label">Ganancia potencial</div>
-          <div class="kpi-value" style="color:{cg};">${inv_ganancia:,.2f}</div>
-          <div class="kpi-sub">Margen {inv_margen:.1f}% sobre precio de mercado</div>
-        </div>""", unsafe_allow_html=True)
+    # tarjetas de inventario en un solo st.markdown (grid CSS)
+    _inv1 = f"""
+    <div class="kpi-card kpi-card-top" style="border-top-color:{AMBER};">
+      <div class="kpi-icon">📦</div>
+      <div class="kpi-label">Capital en stock (costo)</div>
+      <div class="kpi-value" style="color:{AMBER};">${inv_capital:,.2f}</div>
+      <div class="kpi-sub">{inv_unidades} unidades en stock</div>
+    </div>"""
 
+    _inv2 = f"""
+    <div class="kpi-card kpi-card-top" style="border-top-color:{GOLD};">
+      <div class="kpi-icon">💎</div>
+      <div class="kpi-label">Valor a mercado</div>
+      <div class="kpi-value" style="color:{GOLD};">${inv_mercado:,.2f}</div>
+      <div class="kpi-sub">Si se vende todo el stock actual</div>
+    </div>"""
+
+    cg = GREEN if inv_ganancia >= 0 else RED
+    _inv3 = f"""
+    <div class="kpi-card kpi-card-top" style="border-top-color:{cg};">
+      <div class="kpi-icon">{'📈' if inv_ganancia >= 0 else '📉'}</div>
+      <div class="kpi-label">Ganancia potencial</div>
+      <div class="kpi-value" style="color:{cg};">${inv_ganancia:,.2f}</div>
+      <div class="kpi-sub">Margen {inv_margen:.1f}% sobre precio de mercado</div>
+    </div>"""
+
+    st.markdown(
+        '<div class="kpi-grid kpi-grid-3">' + _inv1 + _inv2 + _inv3 + '</div>',
+        unsafe_allow_html=True
+    )
     st.markdown("<div style='height:16px'></div>", unsafe_allow_html=True)
-    st.markdown('</div>', unsafe_allow_html=True)
 
     # Tabla
     st.markdown('<div class="chart-card"><div class="chart-title" style="text-align:center;">Desglose por SKU</div>', unsafe_allow_html=True)
-    tbl = df_inv[['SKU','Producto','Stock (ajustable)','Costo Unit. (USD)','Valor en Stock (USD)','Precio Mercado (USD)','Valor a Mercado (USD)','Ganancia Potencial (USD)']].copy()
-    max_stock = tbl['Stock (ajustable)'].max() or 1
-    def stock_bar(val):
-        pct = val / max_stock * 100
-        return f'<div style="display:flex;align-items:center;gap:8px;min-width:140px;"><span style="font-weight:600;min-width:32px;">{int(val)}</span><div style="flex:1;background:#2a1a14;border-radius:3px;height:6px;"><div style="background:{AMBER};width:{pct:.0f}%;height:6px;border-radius:3px;"></div></div></div>'
-    tbl['Stock'] = tbl['Stock (ajustable)'].apply(stock_bar)
-    tbl = tbl.drop(columns=['Stock (ajustable)'])
-    tbl = tbl.rename(columns={
-        'Costo Unit. (USD)': 'Costo/u',
-        'Valor en Stock (USD)': 'Val. Costo',
-        'Precio Mercado (USD)': 'P. Mercado',
-        'Valor a Mercado (USD)': 'Val. Mercado',
-        'Ganancia Potencial (USD)': 'Gan. Potencial',
+    stock = df_inv['Stock (ajustable)']
+    max_stock = stock.max() or 1
+    # barra de stock armada con operaciones de columna, no una f-string por fila
+    stock_uds = stock.astype(int).astype(str)
+    stock_pct = (stock / max_stock * 100).round().astype(int).astype(str)
+    # tabla de presentación armada de una vez, ya en su orden y con sus nombres
+    # (sin copy + drop + rename + reselección sobre df_inv)
+    tbl = pd.DataFrame({
+        'SKU':            df_inv['SKU'],
+        'Producto':       df_inv['Producto'],
+        'Stock': (
+            '<div style="display:flex;align-items:center;gap:8px;min-width:140px;"><span style="font-weight:600;min-width:32px;">'
+            + stock_uds
+            + f'</span><div style="flex:1;background:#2a1a14;border-radius:3px;height:6px;"><div style="background:{AMBER};width:'
+            + stock_pct
+            + '%;height:6px;border-radius:3px;"></div></div></div>'
+        ),
+        'Costo/u':        df_inv['Costo Unit. (USD)'],
+        'Val. Costo':     df_inv['Valor en Stock (USD)'],
+        'P. Mercado':     df_inv['Precio Mercado (USD)'],
+        'Val. Mercado':   df_inv['Valor a Mercado (USD)'],
+        'Gan. Potencial': df_inv['Ganancia Potencial (USD)'],
     })
-    for col in ['Costo/u','Val. Costo','P. Mercado','Val. Mercado','Gan. Potencial']:
-        tbl[col] = tbl[col].apply(lambda x: f"${x:,.2f}")
-    st.write(
-        '<div style="overflow-x:auto;">'
-        + tbl[['SKU','Producto','Stock','Costo/u','Val. Costo','P. Mercado','Val. Mercado','Gan. Potencial']].to_html(classes='dash-table', escape=False, index=False, border=0)
-        + '</div>',
-        unsafe_allow_html=True
-    )
+    dash_table(tbl, formatters=dict.fromkeys(['Costo/u','Val. Costo','P. Mercado','Val. Mercado','Gan. Potencial'], fmt_usd))
     st.markdown('</div>', unsafe_allow_html=True)
 
     # Donut — mismo ancho que la tabla
@@ -1012,10 +1215,14 @@ if not df_inv.empty:
     st.markdown('<div class="chart-card"><div class="chart-title" style="text-align:center;">Capital por SKU</div><div style="height:16px;"></div>', unsafe_allow_html=True)
     _, dc, _ = st.columns([1, 2, 1])
     with dc:
-        fig_inv = px.pie(
-            df_inv, values='Valor en Stock (USD)', names='SKU',
-            hole=0.6, color_discrete_sequence=CHART_SEQ
-        )
+        # solo las dos columnas que usa el donut, no el frame de inventario completo;
+        # un color fijo por SKU (orden alfabético), igual en todas las filas y filtros
+        skus = df_inv['SKU'].astype(str)
+        color_sku = {sku: CHART_SEQ[i % len(CHART_SEQ)] for i, sku in enumerate(sorted(skus.unique()))}
+        fig_inv = go.Figure(go.Pie(
+            labels=skus.to_numpy(), values=df_inv['Valor en Stock (USD)'].to_numpy(),
+            hole=0.6, marker=dict(colors=skus.map(color_sku).to_numpy())
+        ))
         fig_inv.update_traces(
             textposition='outside', textinfo='label+percent+value',
             texttemplate='<b>%{label}</b><br>%{percent:.0%} · $%{value:,.0f}',
@@ -1031,5 +1238,5 @@ if not df_inv.empty:
 st.markdown('<p class="section-label">Análisis de márgenes</p>', unsafe_allow_html=True)
 st.markdown('<div class="chart-card">', unsafe_allow_html=True)
 if not df_margenes.empty:
-    dash_table(df_margenes)
+    dash_table(df_margenes, formatters=dict.fromkeys(['Costo Total', 'Precio Venta', 'Ganancia'], fmt_usd))
 st.markdown('</div>', unsafe_allow_html=True)